@@ -343,8 +343,8 @@ def merge_overlapping(list_mxs, list_mx_info, source, target, scaffolds, args, g
             print("NOTE: non-singleton, {} source nodes".format(len(source_nodes)))
     if not paths_components:
         return False
-    path = sorted(paths_components, key=lambda x: (x.mapped_region_length, x.median_length_from_end,
-                                                   x.mid_mx), reverse=True)[0]
+    path = max(paths_components, key=lambda x: (x.mapped_region_length, x.median_length_from_end,
+                                                x.mid_mx))
     source_cut, target_cut = list_mx_info[source_noori][path.mid_mx][1], list_mx_info[target_noori][path.mid_mx][1]
 
     if source_cut is None or target_cut is None:
@@ -122,25 +122,27 @@ class NtLink():
     def print_directed_graph(graph, out_prefix, scaffolds):
         "Prints the directed scaffold graph in dot format"
         out_graph = out_prefix + ".scaffold.dot"
-        outfile = open(out_graph, 'w')
         print(datetime.datetime.today(), ": Printing graph", out_graph, sep=" ", file=sys.stdout)
 
-        outfile.write("digraph G {\n")
-        outfile.write("graph [scaf_num={}]\n".format(NtLink.get_largest_ntlink_scaffold_id(scaffolds)))
-
-        for node in graph.vs():
-            node_label = "\"{scaffold}\" [l={length}]\n".\
-                format(scaffold=node['name'], length=NtLink.scaffolds[node['name'][:-1]].length)
-            outfile.write(node_label)
-
-        for edge in graph.es():
-            edge_str = "\"{source}\" -> \"{target}\" [d={d} e={e} n={n}]\n".\
-                format(source=ntlink_utils.vertex_name(graph, edge.source),
-                       target=ntlink_utils.vertex_name(graph, edge.target),
-                       d=int(edge['d']), e=edge['e'], n=edge['n'])
-            outfile.write(edge_str)
-
-        outfile.write("}\n")
+        lines = ["digraph G {",
+                 "graph [scaf_num={}]".format(NtLink.get_largest_ntlink_scaffold_id(scaffolds))]
+
+        names = graph.vs()["name"] if graph.vcount() else []
+        for name in names:
+            lines.append("\"{scaffold}\" [l={length}]".format(scaffold=name,
+                                                              length=NtLink.scaffolds[name[:-1]].length))
+
+        edgelist = graph.get_edgelist()
+        gap_dists = graph.es()["d"] if graph.ecount() else []
+        edge_lengths = graph.es()["e"] if graph.ecount() else []
+        num_links = graph.es()["n"] if graph.ecount() else []
+        for (source, target), d, e, n in zip(edgelist, gap_dists, edge_lengths, num_links):
+            lines.append("\"{source}\" -> \"{target}\" [d={d} e={e} n={n}]".format(
+                source=names[source], target=names[target], d=int(d), e=e, n=n))
+
+        lines.append("}\n")
+        with open(out_graph, 'w') as outfile:
+            outfile.write("\n".join(lines))
 
     def calculate_gap_size(self, i_mx, i_ori, j_mx, j_ori, est_distance):
         "Calculates the estimated distance between two contigs"
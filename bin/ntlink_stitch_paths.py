@@ -6,15 +6,21 @@ __author__ = "laurencoombe"
 
 import argparse
 import datetime
+import multiprocessing
 import re
 import sys
 import os
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import igraph as ig
 import numpy as np
 import ntlink_utils
 from path_node import PathNode
 
+# Compiled pattern for parsing gap nodes in path files
+_FULL_GAP_RE = re.compile(r'^(\d+)N$')
+
+PathGraphInfo = namedtuple("PathGraphInfo", ["name_to_index", "indegrees", "outdegrees", "edges"])
+
 class NtLinkPath:
     "Instance of ntLink stitch path phase"
 
@@ -26,59 +32,42 @@ class NtLinkPath:
 
         graph = ig.Graph(directed=True)
 
-        gap_re = re.compile(r'(\d+)N')
-
         vertices = set()
-        edges = defaultdict(dict)
+        edges = []  # (source, target, gap size, path id)
+        seen_sources = set()
 
         with open(path_filename, 'r') as path_file:
             for path in path_file:
                 path_id, path_sequence = path.strip().split("\t")
                 path_sequence = path_sequence.split(" ")
                 for i, j, k in zip(path_sequence, path_sequence[1:], path_sequence[2:]):
-                    gap_match = re.search(gap_re, j)
-                    if not gap_match:
+                    if not (j[-1] == "N" and j[:-1].isdigit()):
                         continue # Only continue if it is 2 scaffolds with gap between
+                    gap_size = j[:-1]
+
+                    rev_i, rev_k = ntlink_utils.reverse_scaf_ori(i), ntlink_utils.reverse_scaf_ori(k)
 
                     # Add vertices
                     vertices.add(i)
                     vertices.add(k)
-                    vertices.add(ntlink_utils.reverse_scaf_ori(i))
-                    vertices.add(ntlink_utils.reverse_scaf_ori(k))
+                    vertices.add(rev_i)
+                    vertices.add(rev_k)
 
                     # Add edges
-                    assert i not in edges and k not in edges[i]
-                    edges[i][k] = (gap_match.group(1), path_id)
-                    edges[ntlink_utils.reverse_scaf_ori(k)][ntlink_utils.reverse_scaf_ori(i)] = \
-                        (gap_match.group(1), path_id)
+                    assert i not in seen_sources
+                    seen_sources.add(i)
+                    seen_sources.add(rev_k)
+                    edges.append((i, k, gap_size, path_id))
+                    edges.append((rev_k, rev_i, gap_size, path_id))
 
         graph.add_vertices(list(vertices))
 
-        formatted_edges = [(s, t) for s in edges for t in edges[s]]
-        graph.add_edges(formatted_edges)
-
-        edge_attributes = {ntlink_utils.edge_index(graph, s, t): {'d': edges[s][t][0],
-                                                                  "path_id": edges[s][t][1]}
-                           for s in edges for t in edges[s]}
-        graph.es()["d"] = [edge_attributes[e]['d'] for e in sorted(edge_attributes.keys())]
-        graph.es()["path_id"] = [edge_attributes[e]['path_id'] for e in sorted(edge_attributes.keys())]
+        graph.add_edges([(source, target) for source, target, _, _ in edges],
+                        attributes={"d": [edge[2] for edge in edges],
+                                    "path_id": [edge[3] for edge in edges]})
 
         return graph
 
-    @staticmethod
-    def are_end_vertices(source, target, path_graph):
-        "Checks if both the source and target are end vertices"
-        return path_graph.vs()[ntlink_utils.vertex_index(path_graph, source)].outdegree() == 0 and \
-               path_graph.vs()[ntlink_utils.vertex_index(path_graph, target)].indegree() == 0
-
-    @staticmethod
-    def is_end_vertex(graph, node, mode="out"):
-        "Returns true if the given node is an end vertex in mode specified"
-        assert mode in ["out", "in"]
-        if mode == "out":
-            return graph.vs()[ntlink_utils.vertex_index(graph, node)].outdegree() == 0
-        return graph.vs()[ntlink_utils.vertex_index(graph, node)].indegree() == 0
-
     @staticmethod
     def find_new_transitive_edges(edges, path, scaffold_graph, s, t):
         "Given a path, tally transitive edges"
@@ -96,70 +85,68 @@ class NtLinkPath:
                 edges.add((rev_t, rev_s))
 
     @staticmethod
-    def is_contig(node, gap_re):
+    def is_contig(node):
         "Returns true if the given node is a contig, so doesn't fit the regex of a gap node"
-        gap_match = re.search(gap_re, node)
+        gap_match = _FULL_GAP_RE.search(node)
         return not gap_match
 
 
-    def add_transitive_support(self, scaffold_graph, path_sequence, path_graph, neighbourhood=4):
-        "Given a path sequence and a graph, add all transitive edges"
+    def add_transitive_support(self, scaffold_graph, path_sequence, graph_info, neighbourhood=4):
+        "Given a path sequence and the path graph lookups, add all transitive edges"
         edges = set()
-        gap_re = re.compile(r"^\d+N$")
-        path_sequence = [node for node in path_sequence if self.is_contig(node, gap_re)]
+        path_sequence = [node for node in path_sequence if self.is_contig(node)]
+        name_to_index = graph_info.name_to_index
         for idx, s_t in enumerate(zip(path_sequence, path_sequence[1:])):
             s, t = s_t
-            if not (ntlink_utils.has_vertex(path_graph, s) and ntlink_utils.has_vertex(path_graph, t) and
-                    path_graph.are_connected(s, t)):
+            s_index, t_index = name_to_index.get(s), name_to_index.get(t)
+            if s_index is None or t_index is None or (s_index, t_index) not in graph_info.edges:
                 start, end = max(0, idx - neighbourhood), min(len(path_sequence), idx + neighbourhood + 2)
                 path_neighbourhood = path_sequence[start:end] # 1 target, 1 past
                 self.find_new_transitive_edges(edges, path_neighbourhood, scaffold_graph, s, t)
 
         return edges
 
-    def read_alternate_pathfile(self, filename, path_graph, new_vertices, new_edges, scaffold_graph):
+    def read_alternate_pathfile(self, filename, graph_info, new_vertices, new_edges, scaffold_graph):
         "Read through alt abyss-scaffold output file, adding potential new edges"
         print("Reading {}".format(filename), file=sys.stdout)
-        gap_re = re.compile(r'^(\d+)N$')
         trans_edges = set()
 
         if not os.path.exists(filename):
             print("{} does not exist, skipping.".format(filename), file=sys.stdout)
             return set()
+        name_to_index = graph_info.name_to_index
+        indegrees, outdegrees = graph_info.indegrees, graph_info.outdegrees
         with open(filename, 'r') as fin:
             for path in fin:
                 _, path_sequence = path.strip().split("\t")
                 path_sequence = path_sequence.split(" ")
                 trans_edges = set.union(trans_edges, self.add_transitive_support(scaffold_graph,
-                                                                                 path_sequence, path_graph))
+                                                                                 path_sequence, graph_info))
                 for i, j, k in zip(path_sequence, path_sequence[1:], path_sequence[2:]):
-                    gap_match = re.search(gap_re, j)
+                    gap_match = _FULL_GAP_RE.search(j)
                     if not gap_match:
                         continue
                     source, target, gap_est = i, k, int(gap_match.group(1))
-                    if ntlink_utils.has_vertex(path_graph, source) and \
-                            ntlink_utils.has_vertex(path_graph, target):
-                        if path_graph.are_connected(source, target):
+                    source_index, target_index = name_to_index.get(source), name_to_index.get(target)
+                    if source_index is not None and target_index is not None:
+                        if (source_index, target_index) in graph_info.edges:
                             continue # continue if the source/target are already connected
-                        if self.are_end_vertices(source, target, path_graph):
+                        if outdegrees[source_index] == 0 and indegrees[target_index] == 0:
                             self.add_path_edges(gap_est, source, target, new_edges)
 
-                    if ntlink_utils.has_vertex(path_graph, source) and \
-                            not ntlink_utils.has_vertex(path_graph, target) and \
-                            self.is_end_vertex(path_graph, source, mode="out"):
+                    if source_index is not None and target_index is None and \
+                            outdegrees[source_index] == 0:
                         new_vertices.add(target)
                         new_vertices.add(ntlink_utils.reverse_scaf_ori(target))
                         self.add_path_edges(gap_est, source, target, new_edges)
 
-                    if ntlink_utils.has_vertex(path_graph, target) and \
-                            not ntlink_utils.has_vertex(path_graph, source) and \
-                            self.is_end_vertex(path_graph, target, mode="in"):
+                    if target_index is not None and source_index is None and \
+                            indegrees[target_index] == 0:
                         new_vertices.add(source)
                         new_vertices.add(ntlink_utils.reverse_scaf_ori(source))
                         self.add_path_edges(gap_est, source, target, new_edges)
 
-                    if not ntlink_utils.has_vertex(path_graph, source) and \
-                            not ntlink_utils.has_vertex(path_graph, target):
+                    if source_index is None and target_index is None:
                         new_vertices.add(source)
                         new_vertices.add(ntlink_utils.reverse_scaf_ori(source))
 
@@ -172,18 +159,10 @@ class NtLinkPath:
     @staticmethod
     def add_path_edges(gap_dist, source, target, new_edges):
         "Add the new path edges in both orientations to given graph"
-        if (source not in new_edges) or \
-                (source in new_edges and target not in new_edges[source]):
-            new_edges[source][target] = [gap_dist]
-        else:
-            new_edges[source][target].append(gap_dist)
+        new_edges[source].setdefault(target, []).append(gap_dist)
 
-        rev_target, rev_source = ntlink_utils.reverse_scaf_ori(source), ntlink_utils.reverse_scaf_ori(target)
-        if (rev_source not in new_edges) or \
-                (rev_source in new_edges and rev_target not in new_edges[rev_source]):
-            new_edges[rev_source][rev_target] = [gap_dist]
-        else:
-            new_edges[rev_source][rev_target].append(gap_dist)
+        rev_source, rev_target = ntlink_utils.reverse_scaf_ori(target), ntlink_utils.reverse_scaf_ori(source)
+        new_edges[rev_source].setdefault(rev_target, []).append(gap_dist)
 
     def read_alternate_pathfiles(self, path_graph, scaffold_graph, best_filename):
         "Read through alt abyss-scaffold output files, adding potential new edges for paths"
@@ -191,91 +170,93 @@ class NtLinkPath:
         new_vertices = set()
         new_scaffold_edges = set()
 
+        graph_info = PathGraphInfo(name_to_index={vertex["name"]: vertex.index
+                                                  for vertex in path_graph.vs()},
+                                   indegrees=path_graph.indegree(), outdegrees=path_graph.outdegree(),
+                                   edges=set(path_graph.get_edgelist()))
+
         for path_file in self.args.PATH:
             if path_file == best_filename:
                 continue
-            new_trans_edges = self.read_alternate_pathfile(path_file, path_graph, new_vertices,
+            new_trans_edges = self.read_alternate_pathfile(path_file, graph_info, new_vertices,
                                                            new_edges, scaffold_graph)
             new_scaffold_edges = set.union(new_scaffold_edges, new_trans_edges)
 
         path_graph.add_vertices(list(new_vertices))
 
         formatted_edges = []
-        formatted_attributes = []
-        before_edge = path_graph.ecount()
+        d_attributes, n_attributes = [], []
 
         for new_source in new_edges:
             for new_target in new_edges[new_source]:
                 formatted_edges.append((new_source, new_target))
-                d = new_edges[new_source][new_target]
-                formatted_attributes.append(d)
-        path_graph.add_edges(formatted_edges)
-        for i in range(before_edge, path_graph.ecount()):
-            d = formatted_attributes[i - before_edge]
-            path_graph.es()[i]["d"] = int(np.median(d))
-            path_graph.es()[i]["n"] = len(d)
-            path_graph.es()[i]["path_id"] = "new"
+                gap_dists = new_edges[new_source][new_target]
+                d_attributes.append(int(np.median(gap_dists)))
+                n_attributes.append(len(gap_dists))
+        path_graph.add_edges(formatted_edges,
+                             attributes={"d": d_attributes, "n": n_attributes,
+                                         "path_id": ["new"] * len(formatted_edges)})
 
         scaffold_graph.add_edges(list(new_scaffold_edges))
 
     @staticmethod
     def linearize_graph(graph):
         "Filter the graph to linearize it"
-        in_branch_nodes = [node.index for node in graph.vs() if node.indegree() > 1]
+        edge_attr_names = graph.es().attribute_names() if graph.ecount() else []
+        path_ids = graph.es()["path_id"] if "path_id" in edge_attr_names else [None] * graph.ecount()
+        weights = graph.es()["n"] if "n" in edge_attr_names else [None] * graph.ecount()
+
+        in_branch_nodes = np.nonzero(np.asarray(graph.indegree()) > 1)[0].tolist()
         to_remove_edges = set()
         for node in in_branch_nodes:
             max_weight_edge, max_weight = None, None
             incident_edges = graph.incident(node, mode=ig.IN) # pylint: disable=no-member
-            if all((graph.es()[edge]['path_id'] == "new" for edge in incident_edges)):
-                max_weight = max([graph.es()[edge]['n'] for edge in incident_edges])
-                max_weight_edges = [edge for edge in incident_edges if graph.es()[edge]['n'] == max_weight]
+            if all((path_ids[edge] == "new" for edge in incident_edges)):
+                max_weight = max([weights[edge] for edge in incident_edges])
+                max_weight_edges = [edge for edge in incident_edges if weights[edge] == max_weight]
                 if len(max_weight_edges) == 1:
                     max_weight_edge = max_weight_edges[0]
             for edge in incident_edges:
-                if edge != max_weight_edge and graph.es()[edge]['path_id'] == "new":
+                if edge != max_weight_edge and path_ids[edge] == "new":
                     to_remove_edges.add(edge)
 
-        out_branch_nodes = [node.index for node in graph.vs() if node.outdegree() > 1]
+        out_branch_nodes = np.nonzero(np.asarray(graph.outdegree()) > 1)[0].tolist()
         for node in out_branch_nodes:
             max_weight_edge, max_weight = None, None
             incident_edges = graph.incident(node, mode=ig.OUT) # pylint: disable=no-member
-            if all((graph.es()[edge]['path_id'] == "new" for edge in incident_edges)):
-                max_weight = max([graph.es()[edge]['n'] for edge in incident_edges])
-                max_weight_edges = [edge for edge in incident_edges if graph.es()[edge]['n'] == max_weight]
+            if all((path_ids[edge] == "new" for edge in incident_edges)):
+                max_weight = max([weights[edge] for edge in incident_edges])
+                max_weight_edges = [edge for edge in incident_edges if weights[edge] == max_weight]
                 if len(max_weight_edges) == 1:
                     max_weight_edge = max_weight_edges[0]
             for edge in incident_edges:
-                if edge != max_weight_edge and graph.es()[edge]['path_id'] == "new":
+                if edge != max_weight_edge and path_ids[edge] == "new":
                     to_remove_edges.add(edge)
 
-        return_graph = graph.copy()
-        return_graph.delete_edges(list(to_remove_edges))
-
-        return return_graph
+        keep_edges = [edge for edge in range(graph.ecount()) if edge not in to_remove_edges]
+        return graph.subgraph_edges(keep_edges, delete_vertices=False)
 
     @staticmethod
     def is_graph_linear(graph):
         "Given a graph, return True if all the components are linear"
-        for component in graph.components(mode="weak"):
-            component_graph = graph.subgraph(component)
-            if not all(u.indegree() < 2 for u in component_graph.vs()):
-                return False
-            if not all(u.outdegree() < 2 for u in component_graph.vs()):
-                return False
-        return True
+        indegrees = np.asarray(graph.indegree())
+        outdegrees = np.asarray(graph.outdegree())
+        return bool((indegrees < 2).all() and (outdegrees < 2).all())
 
     @staticmethod
     def format_path_contigs(path, component_graph):
         "Given a path (sequence of oriented contigs), format to a path of PathNode"
         return_path = []
-        for ctga, ctgb in zip(path, path[1:]):
-            ctga_name, ctga_ori = ctga[:-1], ctga[-1]
-            edge_index = ntlink_utils.edge_index(component_graph, ctga, ctgb)
-            gap_estimate = component_graph.es()[edge_index]['d']
-            return_path.append(PathNode(contig=ctga_name, ori=ctga_ori,
+        name_to_index = {vertex["name"]: vertex.index for vertex in component_graph.vs()}
+        gap_estimates = dict(zip(component_graph.get_edgelist(),
+                                 component_graph.es()["d"] if component_graph.ecount() else []))
+        path_indices = [name_to_index[ctg] for ctg in path]
+        for i in range(len(path) - 1):
+            ctga = path[i]
+            gap_estimate = gap_estimates[(path_indices[i], path_indices[i + 1])]
+            return_path.append(PathNode(contig=ctga[:-1], ori=ctga[-1],
                                         gap_size=gap_estimate))
-        last_ctg_name, last_ctg_ori = path[-1][:-1], path[-1][-1]
-        return_path.append(PathNode(contig=last_ctg_name, ori=last_ctg_ori))
+        return_path.append(PathNode(contig=path[-1][:-1], ori=path[-1][-1]))
         return return_path
 
     def find_paths_process(self, component):
@@ -304,10 +285,10 @@ class NtLinkPath:
         visited = set()
         return_paths = []
         for path in paths:
-            if not any((node.contig in visited for node in path)):
+            path_contigs = {node.contig for node in path}
+            if visited.isdisjoint(path_contigs):
                 return_paths.append(path)
-            for node in path:
-                visited.add(node.contig)
+            visited.update(path_contigs)
         return return_paths
 
     def find_paths(self, graph):
@@ -317,22 +298,26 @@ class NtLinkPath:
         components = graph.components(mode="weak")
         print("\nTotal number of components in graph:", len(components), "\n", sep=" ", file=sys.stdout)
 
-        paths = [self.find_paths_process(component) for component in components]
+        num_processes = min(len(components), os.cpu_count() or 1)
+        if num_processes > 1 and "fork" in multiprocessing.get_all_start_methods():
+            # Forked workers inherit the graph through NtLinkPath.gin
+            with multiprocessing.get_context("fork").Pool(num_processes) as pool:
+                paths = pool.map(self.find_paths_process, components)
+        else:
+            paths = [self.find_paths_process(component) for component in components]
 
         paths_return = [path for path_list in paths for path in path_list]
         paths_return = self.remove_duplicate_paths(paths_return)
         return paths_return
 
     @staticmethod
-    def has_transitive_support(edge, path_graph, scaffold_graph):
+    def has_transitive_support(source, target, path_graph, scaffold_graph, vertex_names):
         "Returns True if edge has transitive support"
-        source, target = ntlink_utils.vertex_name(path_graph, edge.source), \
-                         ntlink_utils.vertex_name(path_graph, edge.target)
         source_pass, target_pass = False, False
         path_size = len(path_graph.vs())
-        source_in_neighbourhood = [ntlink_utils.vertex_name(path_graph, idx)
+        source_in_neighbourhood = [vertex_names[idx]
                                    for idx in path_graph.neighborhood(source, order=path_size, mode="in")]
-        target_out_neighbourhood = [ntlink_utils.vertex_name(path_graph, idx)
+        target_out_neighbourhood = [vertex_names[idx]
                                     for idx in path_graph.neighborhood(target, order=path_size, mode="out")]
         for test_source in source_in_neighbourhood:
             for test_target in target_out_neighbourhood:
@@ -353,11 +338,14 @@ class NtLinkPath:
     def transitive_filter(self, path_graph, scaffold_graph):
         "Filter out edges without any transitive support"
         edges_to_remove = set()
-        for edge in path_graph.es():
-            if edge["path_id"] != "new":
+        vertex_names = path_graph.vs()["name"] if path_graph.vcount() else []
+        path_ids = path_graph.es()["path_id"] if path_graph.ecount() else []
+        for edge_index, (source_index, target_index) in enumerate(path_graph.get_edgelist()):
+            if path_ids[edge_index] != "new":
                 continue
-            if not self.has_transitive_support(edge, path_graph, scaffold_graph):
-                edges_to_remove.add(edge.index)
+            if not self.has_transitive_support(vertex_names[source_index], vertex_names[target_index],
+                                               path_graph, scaffold_graph, vertex_names):
+                edges_to_remove.add(edge_index)
 
         new_graph = path_graph.copy()
         new_graph.delete_edges(list(edges_to_remove))
@@ -382,7 +370,7 @@ class NtLinkPath:
                         continue
                     n50 = float(n50)
                     if n50 > best_n50:
-                        name_match = re.search(n_match, name)
+                        name_match = n_match.search(name)
                         best_n50 = n50
                         best_n = int(name_match.group(1))
                         best_file = path_filename
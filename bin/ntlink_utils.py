@@ -5,7 +5,8 @@ General utility functions for ntLink
 __author__ = "Lauren Coombe @lcoombe"
 
 import datetime
-from collections import namedtuple, defaultdict
+import functools
+from collections import namedtuple
 import os
 import re
 import sys
@@ -19,6 +20,9 @@ from read_fasta import read_fasta
 Scaffold = namedtuple("Scaffold", ["id", "length"])
 MinimizerPositions = namedtuple("MinimizerPositions", ["ctg_pos", "ctg_strand", "read_pos", "read_strand"])
 
+# Compiled patterns for parsing scaffold graph dot files
+_SCAF_NUM_RE = re.compile(r'graph \[scaf_num=(\S+)\]')
+
 class HiddenPrints:
     "Adapted from: https://stackoverflow.com/questions/8391411/how-to-block-calls-to-print"
     def __init__(self):
@@ -82,10 +86,24 @@ def reverse_orientation(orientation):
         return "-"
     return "+"
 
+@functools.lru_cache(maxsize=None)
 def reverse_scaf_ori(scaffold):
     "Reverse orientation of scaffold"
     return scaffold[:-1] + reverse_orientation(scaffold[-1])
 
+def parse_dot_attributes(line):
+    "Parse the bracketed attribute block of a dot file line into a key -> value dict"
+    bracket_start, bracket_end = line.find('['), line.rfind(']')
+    if bracket_start == -1 or bracket_end < bracket_start:
+        return None
+    attributes = {}
+    for attribute in line[bracket_start + 1:bracket_end].split():
+        key, sep, value = attribute.partition('=')
+        if not sep:
+            return None
+        attributes[key] = value
+    return attributes
+
 def read_scaffold_graph(in_graph_file):
     "Reads in a scaffold graph in dot format"
     print(datetime.datetime.today(), ": Reading scaffold file", in_graph_file, file=sys.stdout)
@@ -93,14 +111,11 @@ def read_scaffold_graph(in_graph_file):
     graph = ig.Graph(directed=True)
 
     vertices = set()
-    edges = defaultdict(dict)  # source -> target -> EdgeInfo
+    edges = []  # (source, target, gap estimate, num links)
+    seen_edges = set()
 
     scaf_num = None
 
-    scaf_num_re = re.compile(r'graph \[scaf_num=(\S+)\]')
-    node_re = re.compile(r'\"(\S+[+-])\"\s+\[l\=\d+\]')
-    edge_re = re.compile(r'\"(\S+[+-])\"\s+\-\>\s+\"(\S+[+-])\"\s+\[d\=(\-?\d+)\s+e\=\d+\s+n\=(\d+)\]')
-
     past_header = False
 
     with open(in_graph_file, 'r') as in_graph:
@@ -109,18 +124,27 @@ def read_scaffold_graph(in_graph_file):
             if not past_header:
                 past_header = True
                 continue
-            node_match = re.search(node_re, line)
-            if node_match:
-                vertices.add(node_match.group(1))
-                continue
-
-            edge_match = re.search(edge_re, line)
-            if edge_match:
-                source, target, gap_est, num_links = edge_match.group(1), edge_match.group(2), \
-                                                     edge_match.group(3), edge_match.group(4)
-                edges[source][target] = (int(gap_est), int(num_links))
-                continue
-            scaf_num_match = re.search(scaf_num_re, line)
+            if "->" in line:
+                quoted = line.split('"')
+                attributes = parse_dot_attributes(line)
+                if len(quoted) == 5 and attributes is not None and \
+                        quoted[1] and quoted[1][-1] in "+-" and \
+                        quoted[3] and quoted[3][-1] in "+-" and \
+                        "d" in attributes and "e" in attributes and "n" in attributes and \
+                        attributes["d"].lstrip("-").isdigit() and attributes["n"].isdigit():
+                    if (quoted[1], quoted[3]) not in seen_edges:
+                        seen_edges.add((quoted[1], quoted[3]))
+                        edges.append((quoted[1], quoted[3], int(attributes["d"]), int(attributes["n"])))
+                    continue
+            elif line.startswith('"'):
+                quoted = line.split('"')
+                attributes = parse_dot_attributes(line)
+                if len(quoted) == 3 and attributes is not None and \
+                        quoted[1] and quoted[1][-1] in "+-" and \
+                        "l" in attributes and attributes["l"].isdigit():
+                    vertices.add(quoted[1])
+                    continue
+            scaf_num_match = _SCAF_NUM_RE.search(line)
             if scaf_num_match:
                 try:
                     scaf_num = int(scaf_num_match.group(1))
@@ -130,15 +154,10 @@ def read_scaffold_graph(in_graph_file):
                 print("Error! Unexpected line in input dot file:", line)
                 sys.exit(1)
 
-    formatted_edges = [(s, t) for s in edges for t in edges[s]]
     graph.add_vertices(list(vertices))
-    graph.add_edges(formatted_edges)
-
-    edge_attributes = {edge_index(graph, s, t): {'d': edges[s][t][0],
-                                                 "n": edges[s][t][1]}
-                       for s in edges for t in edges[s]}
-    graph.es()["d"] = [edge_attributes[e]['d'] for e in sorted(edge_attributes.keys())]
-    graph.es()["n"] = [edge_attributes[e]['n'] for e in sorted(edge_attributes.keys())]
+    graph.add_edges([(source, target) for source, target, _, _ in edges],
+                    attributes={"d": [edge[2] for edge in edges],
+                                "n": [edge[3] for edge in edges]})
 
     return graph, scaf_num
 
@@ -155,7 +174,7 @@ def find_valid_mx_regions(args, gap_re, graph, scaffolds):
             path_seq = normalize_path(path_seq, gap_re)
             for source, gap, target in zip(path_seq, path_seq[1:], path_seq[2:]):
                 source_noori, target_noori = source.strip("+-"), target.strip("+-")
-                gap_match = re.search(gap_re, gap)
+                gap_match = gap_re.search(gap)
                 if not gap_match:
                     continue
                 if int(gap_match.group(1)) <= args.g + 1 and has_estimated_overlap(graph, source, target):
@@ -179,7 +198,7 @@ def normalize_path(path_sequence, gap_re):
         return path_sequence
     new_seq = []
     for node in reversed(path_sequence):
-        if re.search(gap_re, node):
+        if gap_re.search(node):
             new_seq.append(node)
         else:
             new_seq.append(reverse_scaf_ori(node))